@@ -1,10 +1,16 @@
 import os
 import time
+import random
+import shutil
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import _base as _futures_base
 from enum import Enum
-from collections import namedtuple
+from collections import namedtuple, deque
+from urllib.parse import urlsplit
 
 
 class ImgDownloadState(Enum):
@@ -30,7 +36,7 @@ class ImgDownloadState(Enum):
         :param state: value which should be checked whether it is a part of this Enum.
         :return: True in case passed value is a part of this Enum. False otherwise.
         """
-        return any(state == item for item in cls)
+        return isinstance(state, cls)
 
 
 ImgDownloadInfo = namedtuple('ImgDownloadInfo', 'url path state exception')
@@ -46,38 +52,56 @@ Information about the downloading image
 
 class ImgDownloader:
     class _ImgItem:
+        # avoid per-instance dictionary, as one object is created for each downloading image
+        __slots__ = ('url', 'dir_out', 'name', '_path', 'exception', 'is_user_cancelled', 'is_sent_to_obsrvr')
+
         def __init__(self, url, dir_out):
             """
             Information about the downloading image.
 
             :param url: url of the image
-            :param dir_out: dir_out desired output image directory
+            :param dir_out: dir_out desired output image directory ending with the path separator
             """
             self.url = url
             self.dir_out = dir_out
 
-            # make sure that the passed output directory has correct ending
-            if len(self.dir_out) > 1:
-                if self.dir_out[-1] != '/':
-                    self.dir_out += '/'
-            else:
-                self.dir_out += './'
-
             self.name = None  # name of the image
+            self._path = None  # path to the image, updated together with the name
             self.exception = None  # stores exception occured during downloading
             self.is_user_cancelled = False  # flags which identifies if the download task was cancelled by user
             self.is_sent_to_obsrvr = False  # flag to identify whether the information from this
             # item has been already sent to the observer or not.
 
+        def set_name(self, name):
+            self.name = name
+            self._path = os.path.join(self.dir_out, name)
+
         def get_path(self):
-            img_path = None
-            if self.name is not None:
-                img_path = self.dir_out + self.name
-            return img_path
+            return self._path
+
+    class _CancellableRaw:
+        def __init__(self, raw, img_item):
+            """
+            File-like wrapper around the raw response stream, which stops the reading as soon as
+            the download task is cancelled by user.
+
+            :param raw: raw response stream to read the image data from
+            :param img_item: :class:`_ImgItem` object of the downloading image
+            """
+            self._raw = raw
+            self._img_item = img_item
 
-    DOWNLOAD_FAIL_MAX = 10
+        def read(self, size=-1):
+            if self._img_item.is_user_cancelled:
+                # empty data means end of the stream - copying is stopped
+                return b''
+            return self._raw.read(size)
+
+    DOWNLOAD_FAIL_MAX = 5
     """
-    Maximum number of retries to download image in case of some errors.
+    Maximum number of retries to download image in case of some errors. Before the download fails the thread sleeps
+    at most the sum of min(:attr:`DOWNLOAD_FAIL_RETRY_T` * 2^n + :attr:`DOWNLOAD_FAIL_RETRY_JITTER`,
+    :attr:`DOWNLOAD_FAIL_RETRY_T_MAX`) for n from 0 to DOWNLOAD_FAIL_MAX - 1.
     
     ATTENTION: Don't make this value too big! There is a worst case scenario when all threads will be blocked
     e.g. by retrying to use invalid link. If functionality for retrying to download image e.g. every 1 hour is needed,
@@ -85,15 +109,42 @@ class ImgDownloader:
     download this image) 
     """
 
-    DOWNLOAD_FAIL_RETRY_T = 0.5
-    """ Time to wait in seconds between retrying to download again.
+    DOWNLOAD_FAIL_RETRY_T = 0.2
+    """ Time to wait in seconds before the first retry to download again. The time is doubled with each next retry
+    (up to :attr:`DOWNLOAD_FAIL_RETRY_T_MAX`) and a small random delay (up to :attr:`DOWNLOAD_FAIL_RETRY_JITTER`)
+    is added, so that download tasks failed at the same time don't retry all at once.
     
     ATTENTION: Don't make this time too big! There is a worst case scenario when all threads will be blocked
     e.g. by retrying to use invalid link. If functionality for retrying to download image e.g. every 1 hour is needed,
     thread scheduler has to be implemented with adding different priorities to images (based on the attempts to
     download this image) """
 
-    def __init__(self, threads_max=8):
+    DOWNLOAD_FAIL_RETRY_T_MAX = 2.0
+    """ Maximum time to wait in seconds between retrying to download again (jitter included). Together with
+    :attr:`DOWNLOAD_FAIL_RETRY_T` and :attr:`DOWNLOAD_FAIL_MAX` it bounds the worst case total wait of one image. """
+
+    DOWNLOAD_FAIL_RETRY_JITTER = 0.1
+    """ Maximum random time in seconds added to the time to wait before retrying to download again. """
+
+    DOWNLOAD_TIMEOUT = (3, 30)
+    """ Timeouts in seconds for connecting to the server and for waiting for the data from the server.
+    Connecting should be fast, therefore unreachable servers are detected early, while slow servers still have time
+    to send the image. """
+
+    PART_EXTENSION = '.part'
+    """ Extension added to the name of the image while it is being downloaded. """
+
+    DOWNLOAD_CHUNK = 1 << 16
+    """ Size in bytes of the data chunks which are read from the network and written into the image file.
+    The download task can be cancelled by user only between two chunks. """
+
+    THREADS_MAX_DEFAULT = min(32, (os.cpu_count() or 4) * 5)
+    """ Default maximum number of threads executing download tasks in parallel. """
+
+    HOST_THREADS_MAX_DEFAULT = 8
+    """ Default maximum number of download tasks downloading images from the same host in parallel. """
+
+    def __init__(self, threads_max=THREADS_MAX_DEFAULT, host_threads_max=HOST_THREADS_MAX_DEFAULT):
         """
         This class is responsible for downloading images from internet. It provides various methods for performing
         different download operations (e.g. download, cancel, remove, restart operations). It also allows a caller to
@@ -104,16 +155,67 @@ class ImgDownloader:
         retries to continue downloading several times and after that starts another download task.
 
         :param threads_max: maximum number of threads which can run and execute download tasks in parallel.
+        Download tasks spend most of the time waiting for the network, therefore this value is not limited by
+        the number of CPU cores and can be increased to download more images in parallel.
+        :param host_threads_max: maximum number of download tasks downloading images from the same host in parallel,
+        or None to not limit them. Limits the number of connections to one host, which otherwise can refuse to serve
+        too many requests at once. Download tasks waiting for their host don't occupy the threads, so images from
+        other hosts are downloaded meanwhile.
         """
         if threads_max <= 0:
             raise ValueError("threads_max has to be greater than 0")
+        if (host_threads_max is not None) and (host_threads_max <= 0):
+            raise ValueError("host_threads_max has to be greater than 0")
 
         self._tpool = ThreadPoolExecutor(threads_max)  # Thread executing pool containing threads executing download tasks
-        self._dwnlds = {}  # dictionary with all download tasks.
-        # Each dictionary item has format of the tuple: ('url' : (_ImgItem object, Future object))
+        self._session = requests.Session()  # HTTP session shared by all download tasks to reuse connections
+        self._adapter = self._mount_adapter(threads_max)  # HTTP adapter keeping the connections of the thread pool
+        self._tpools_retired = []  # previous thread pools in format (ThreadPoolExecutor, HTTPAdapter)
+        # download tasks are stored in the dictionaries with the same keys (urls of the images)
+        self._items = {}  # information about downloading images in format ('url' : _ImgItem object)
+        self._futures = {}  # states of the download tasks in format ('url' : Future object)
+        self._future_to_url = {}  # reverse mapping of the download tasks in format (Future object : 'url')
+        self._dir_names = {}  # names of the files in the output directories in format ('dir_out' : set of names)
+        self._host_threads_max = host_threads_max
+        self._hosts_lock = threading.Lock()  # guards the host counters and queues, used also by the download threads
+        self._hosts_running = {}  # download tasks passed to the thread pool in format ('host' : number of tasks)
+        self._hosts_queued = {}  # download tasks waiting for a free thread of the host in format ('host' : deque)
 
 ######################################## PRIVATE FUNCTION DEFINITIONS #################################################
 
+    def _mount_adapter(self, threads_max):
+        """
+        Mount new HTTP adapter to the session, with connection pool sized to the number of threads, so that
+        each thread can keep its own connection alive.
+        Retries are handled by the download task itself (see :func:`_download_img`)
+
+        :param threads_max: maximum number of threads executing download tasks in parallel.
+        :return: mounted HTTPAdapter object
+        """
+        adapter = HTTPAdapter(pool_connections=threads_max, pool_maxsize=threads_max, pool_block=True, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        return adapter
+
+    def _get_dir_names(self, dir_out):
+        """
+        Return the names of the files in the output directory. The directory is listed only once,
+        after that names of the images added for downloading are tracked in the returned set. Files created
+        by somebody else afterwards are not in the set, so a chosen name still has to be checked on disk.
+
+        :param dir_out: output image directory
+        :return: set with the names of the files in the output directory
+        """
+        names = self._dir_names.get(dir_out)
+        if names is None:
+            try:
+                names = set(os.listdir(dir_out))
+            except OSError:
+                # directory doesn't exist or can't be read
+                names = set()
+            self._dir_names[dir_out] = names
+        return names
+
     def _update_img_name(self, img_item, do_rewrite):
         """
         Extract the name of the image from URL, and assign to the passed img_item.
@@ -122,33 +224,62 @@ class ImgDownloader:
         :param do_rewrite: if False then unique name will be given to the img_item.
         """
 
-        # extract image name from the url
-        img_name_full = img_item.url.split('/')[-1]
+        # extract image name from the path of the url (without query and fragment parts)
+        img_name_full = urlsplit(img_item.url).path.split('/')[-1]
 
         # split image name for extension and name itself
-        extension = os.path.splitext(img_name_full)[1]
-        img_name = os.path.splitext(img_name_full)[0]
+        img_name, extension = os.path.splitext(img_name_full)
 
-        img_path = img_item.dir_out + img_name
+        names = self._get_dir_names(img_item.dir_out)
         postfix = ""
 
-        if not os.path.exists(img_item.dir_out):
-            # create output directory as it doesn't exist
-            try:
-                os.makedirs(img_item.dir_out)
-            except OSError as e:
-                # some error during creating the directory
-                pass
-        # if no directory exists, we can be sure, that file with the specified name also doesn't exist there
-        elif not do_rewrite:
+        if not do_rewrite:
             # in case image with the specified name already exists in output folder - add unique postfix to the name
+            # the listing may be outdated, so the candidate which is free in it is confirmed on disk as well
             n = 1
-            while os.path.isfile(img_path + postfix + extension):
+            while ((img_name + postfix + extension) in names or
+                   os.path.exists(os.path.join(img_item.dir_out, img_name + postfix + extension))):
+                names.add(img_name + postfix + extension)
                 n += 1
                 postfix = "_" + str(n)
 
         # set final image name
-        img_item.name = img_name + postfix + extension
+        img_item.set_name(img_name + postfix + extension)
+        names.add(img_item.name)
+
+    def _is_retry_useless(self, e):
+        """
+        Check whether the download has to be stopped without retrying because of the passed exception.
+
+        :param e: exception occurred during downloading
+        :return: True in case the server reported a client error (e.g. 404 Not Found), which will not disappear
+        after retrying. False otherwise.
+        """
+        if isinstance(e, requests.exceptions.HTTPError) and (e.response is not None):
+            status = e.response.status_code
+            # request timeout and too many requests errors can disappear after some time
+            return (400 <= status < 500) and (status not in (408, 429))
+        return False
+
+    def _create_part_file(self, img_path):
+        """
+        Create new empty temporary file, into which the image is downloaded. Already existing files are never reused,
+        so that e.g. not completely downloaded file of a browser with the same name is not overwritten.
+
+        :param img_path: path to the image
+        :return: path to the created temporary file
+        """
+        n = 1
+        postfix = ""
+        while True:
+            img_path_part = img_path + postfix + ImgDownloader.PART_EXTENSION
+            try:
+                # file is created only in case it doesn't exist yet
+                open(img_path_part, 'xb').close()
+                return img_path_part
+            except FileExistsError:
+                n += 1
+                postfix = "." + str(n)
 
     def _download_img(self, img_item, do_rewrite):
         """
@@ -162,47 +293,153 @@ class ImgDownloader:
         """
         img_item.is_sent_to_obsrvr = False  # reset flag as after each download we should notify observer again
 
+        # image is written into the temporary file first, so that not completely downloaded image
+        # never appears under its name. The file is created with the first response and reused by the retries
+        img_path_part = None
+
         # start downloading
         fail_cnt = 0
         is_downloading = True
+        is_downloaded = False
 
         while is_downloading:
             try:
                 """try to retrieve the image as a stream (without storing everything in the memory, 
                 but storing only small chunks). """
-                response = requests.get(img_item.url, stream=True, timeout=10)
-                if response.status_code == requests.codes.ok:
-                    # start writing chunks of data into the file
-                    with open(img_item.get_path(), 'wb') as img_f:
-                        for chunk in response.iter_content(chunk_size=512):
-                            if img_item.is_user_cancelled:
-                                # exit the task - user has cancelled the download
-                                break
-                            if chunk:
-                                img_f.write(chunk)
-
-                    # download is finished
-                    is_downloading = False
-                else:
-                    # response is not OK (most probably URL is not correct), raise status exception
-                    response.raise_for_status()
+                # response is closed at the end, so that its connection is returned to the pool in any case
+                with self._session.get(img_item.url, stream=True, timeout=ImgDownloader.DOWNLOAD_TIMEOUT) as response:
+                    if response.status_code == requests.codes.ok:
+                        # start writing chunks of data into the file
+                        # decode the data in case it is compressed by the server (e.g. gzip)
+                        response.raw.decode_content = True
+                        if img_path_part is None:
+                            img_path_part = self._create_part_file(img_item.get_path())
+                        # buffer has the size of the chunk, so whole chunks are passed to the file without copying,
+                        # while the buffered file still completes short writes of the operating system
+                        with open(img_path_part, 'wb', buffering=ImgDownloader.DOWNLOAD_CHUNK) as img_f:
+                            # copying is stopped as soon as user cancels the download
+                            shutil.copyfileobj(self._CancellableRaw(response.raw, img_item), img_f,
+                                               ImgDownloader.DOWNLOAD_CHUNK)
+
+                        if not img_item.is_user_cancelled:
+                            # image is completely downloaded - make it visible under its name at once
+                            os.replace(img_path_part, img_item.get_path())
+                            is_downloaded = True
+
+                        # download is finished
+                        is_downloading = False
+                    else:
+                        # response is not OK (most probably URL is not correct), raise status exception
+                        response.raise_for_status()
             except Exception as e:
                 # some exception occurred during retrieving the image (e.g. wrong URL or connection is lost)
                 if img_item.is_user_cancelled:
                     # exit the task - user has cancelled the download
                     is_downloading = False
                 else:
-                    if fail_cnt < ImgDownloader.DOWNLOAD_FAIL_MAX:
+                    if (fail_cnt < ImgDownloader.DOWNLOAD_FAIL_MAX) and not self._is_retry_useless(e):
                         fail_cnt += 1
-                        # try to download image again after some time
-                        time.sleep(ImgDownloader.DOWNLOAD_FAIL_RETRY_T)
+                        # try to download image again after some time, which grows with each failed attempt
+                        retry_t = (ImgDownloader.DOWNLOAD_FAIL_RETRY_T * (2 ** (fail_cnt - 1)) +
+                                   random.uniform(0, ImgDownloader.DOWNLOAD_FAIL_RETRY_JITTER))
+                        time.sleep(min(retry_t, ImgDownloader.DOWNLOAD_FAIL_RETRY_T_MAX))
                     else:
                         # store exception and let the caller decide what to do with this exception
                         img_item.exception = e
                         is_downloading = False
 
+        if (not is_downloaded) and (img_path_part is not None):
+            # download was cancelled or failed - remove partially downloaded image
+            try:
+                os.remove(img_path_part)
+            except OSError:
+                # file was already removed by somebody else
+                pass
+
         return img_item
 
+    def _schedule(self, host, future, img_item, do_rewrite):
+        """
+        Pass the download task to the thread pool in case its host has a free thread, otherwise put it into the queue
+        of the host. Queued download tasks don't occupy the threads of the pool.
+
+        :param host: host of the image URL
+        :param future: Future object of the download task
+        :param img_item: :class:`_ImgItem` object containing information about the downloading image.
+        :param do_rewrite: see :func:`_download_img`
+        """
+        # thread pool is read under the lock, as it can be replaced by resize_pool() meanwhile
+        with self._hosts_lock:
+            n_running = self._hosts_running.get(host, 0)
+            if (self._host_threads_max is None) or (n_running < self._host_threads_max):
+                # raises RuntimeError in case the thread pool is already shut down - download task is not added
+                self._tpool.submit(self._run_task, host, future, img_item, do_rewrite)
+                self._hosts_running[host] = n_running + 1
+            else:
+                self._hosts_queued.setdefault(host, deque()).append((future, img_item, do_rewrite))
+
+    def _release_host(self, host):
+        """
+        Called after the download task of the host is done. Passes the next queued download task of the host
+        to the thread pool, or frees the thread of the host in case there is nothing to download.
+
+        :param host: host of the image URL
+        """
+        is_host_busy = False
+        # thread pool is read under the lock, as it can be replaced by resize_pool() meanwhile
+        with self._hosts_lock:
+            queue = self._hosts_queued.get(host)
+            while queue and not is_host_busy:
+                (future, img_item, do_rewrite) = queue.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    self._tpool.submit(self._run_task, host, future, img_item, do_rewrite)
+                    is_host_busy = True
+                except RuntimeError as e:
+                    # thread pool is already shut down - download task can't be executed, so it is not left pending
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+            if not queue:
+                self._hosts_queued.pop(host, None)
+            if not is_host_busy:
+                self._hosts_running[host] -= 1
+                if self._hosts_running[host] == 0:
+                    del self._hosts_running[host]
+
+    def _run_task(self, host, future, img_item, do_rewrite):
+        """
+        Execute the download task in the thread of the pool and store its result in the Future object of the task.
+
+        :param host: host of the image URL
+        :param future: Future object of the download task
+        :param img_item: :class:`_ImgItem` object containing information about the downloading image.
+        :param do_rewrite: see :func:`_download_img`
+        """
+        try:
+            # download task is not started in case it was cancelled while waiting for the thread
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._download_img(img_item, do_rewrite))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._release_host(host)
+
+    def _get_future_state(self, future):
+        """
+        Return the state of the future object by reading it directly. Unlike calling :func:`Future.cancelled`,
+        :func:`Future.done` and :func:`Future.running` one after another, it doesn't acquire the lock of the future
+        several times and can't observe different states during one check.
+
+        :param future: Future object
+        :return: one of the PENDING, RUNNING, CANCELLED or FINISHED states of the :mod:`concurrent.futures` module
+        """
+        state = future._state
+        if state == _futures_base.CANCELLED_AND_NOTIFIED:
+            state = _futures_base.CANCELLED
+        return state
+
     def _get_download_state(self, img_item, future):
         """
         Return :class:`ImgDownloadingState` based on the state of img_item and future objects.
@@ -212,21 +449,20 @@ class ImgDownloader:
         :param future: Future object which is used to identify current download state of the download task.
         :return: :class:`ImgDownloadingState` object related to the downloading image from URL specified inside img_item.
         """
+        future_state = self._get_future_state(future)
+
         state = ImgDownloadState.PENDING
-        if future.cancelled():
+        if future_state == _futures_base.CANCELLED:
             state = ImgDownloadState.CANCELLED
-            if future.exception is not None:
-                # during thread execution some unhandled exception occurred
-                state = ImgDownloadState.CANCELLED_ERROR
-        elif future.done():
+        elif future_state == _futures_base.FINISHED:
             state = ImgDownloadState.FINISHED
-            if img_item.exception is not None:
-                # during image download some exception occurred
-                state = ImgDownloadState.CANCELLED_ERROR
-            elif img_item.is_user_cancelled:
+            if img_item.is_user_cancelled:
                 # user cancelled the download task
                 state = ImgDownloadState.CANCELLED
-        elif future.running():
+            elif (img_item.exception is not None) or (future._exception is not None):
+                # during image download or thread execution some exception occurred
+                state = ImgDownloadState.CANCELLED_ERROR
+        elif future_state == _futures_base.RUNNING:
             state = ImgDownloadState.RUNNING
         else:
             pass
@@ -245,20 +481,23 @@ class ImgDownloader:
 
         return ImgDownloadInfo(img_item.url, img_item.get_path(), state, img_item.exception)
 
-    def _cancel(self, img_item, future):
+    def _cancel(self, dwnlds):
         """
         See description of the :func:`cancel` method
 
-        :param img_item: :class:`_ImgItem` object containing information about the download task to cancel
-        :param future: Future object containing information about the download task thread to cancel
+        :param dwnlds: list of tuples (:class:`_ImgItem` object, Future object) with the information about
+        the download tasks to cancel
         """
 
-        # change img_item state to cancelled by user state - it will cancel the running futures
-        img_item.is_user_cancelled = True
-        # try to cancel a future (it will work only if future is not in the running state)
-        if not future.cancel():
-            # wait until future finishes its task
-            future.result()
+        # change state of all img_items to cancelled by user state - it will cancel the running futures
+        for (img_item, future) in dwnlds:
+            img_item.is_user_cancelled = True
+
+        # try to cancel the futures (it will work only if future is not in the running state)
+        futures_running = [future for (img_item, future) in dwnlds if not future.cancel()]
+
+        # wait until all running futures finish their tasks
+        concurrent.futures.wait(futures_running)
 
     def _submit(self, img_item, do_rewrite):
         """
@@ -276,8 +515,17 @@ class ImgDownloader:
             # update name of the image
             self._update_img_name(img_item, do_rewrite)
 
-        future = self._tpool.submit(self._download_img, img_item, do_rewrite)
-        self._dwnlds[img_item.url] = (img_item, future)
+        future_prev = self._futures.get(img_item.url)
+        if future_prev is not None:
+            # download task is restarted - forget the previous future
+            self._future_to_url.pop(future_prev, None)
+
+        # download task is tracked by its own Future object, as it can wait for the host before entering the pool
+        future = concurrent.futures.Future()
+        self._schedule(urlsplit(img_item.url).netloc, future, img_item, do_rewrite)
+        self._items[img_item.url] = img_item
+        self._futures[img_item.url] = future
+        self._future_to_url[future] = img_item.url
 
 ######################################## PUBLIC FUNCTION DEFINITIONS #################################################
 
@@ -288,9 +536,9 @@ class ImgDownloader:
 
         :return: total amount of the completed download tasks
         """
-        return len(self.get_download_infos_by_state(ImgDownloadState.FINISHED,
-                                                    ImgDownloadState.CANCELLED,
-                                                    ImgDownloadState.CANCELLED_ERROR))
+        # download task has one of these states as soon as its future is done
+        futures_states_done = (_futures_base.CANCELLED, _futures_base.FINISHED)
+        return sum(1 for future in self._futures.values() if self._get_future_state(future) in futures_states_done)
 
     @property
     def imgs_total(self):
@@ -298,7 +546,7 @@ class ImgDownloader:
 
         :return: total amount of the images added for downloading.
         """
-        return len(self._dwnlds)
+        return len(self._items)
 
     def download(self, dir_out, do_rewrite=False, *urls):
         """
@@ -318,8 +566,18 @@ class ImgDownloader:
         :param urls: URLs to the images to download
         """
 
+        # make sure that the passed output directory has correct ending
+        dir_out = os.path.join(dir_out or os.curdir, '')
+
+        try:
+            # create output directory in case it doesn't exist (e.g. it was removed after the previous download)
+            os.makedirs(dir_out, exist_ok=True)
+        except OSError as e:
+            # some error during creating the directory
+            pass
+
         for url in urls:
-            if url in self._dwnlds:
+            if url in self._items:
                 """ specified url already exists - do nothing """
                 pass
             else:
@@ -339,24 +597,23 @@ class ImgDownloader:
 
         :param done_callback: callback function which will be called every time
         after the information about completed and not yet sent download task is available.
-        The callback is called with a single argument - :class:`ImgDownloadInfo` object
+        The callback is called with a single argument - :class:`ImgDownloadInfo` object. It is executed in the thread
+        of the caller, therefore it doesn't block the download threads.
         :type done_callback: callbackFunction(:class:`ImgDownloadInfo`)
         """
-        futures = [future for (img_item, future) in self._dwnlds.values()]
+        futures = list(self._futures.values())
         for f_complete in concurrent.futures.as_completed(futures):
             img_item = None
             try:
                 img_item = f_complete.result()
             except Exception as e:
                 """ Exception can occur only in case future object was cancelled in meantime """
-                """ map future to img_item. We expect that exception is rare 
-                case and therefore it is ok to perform linear search """
-                img_items = [img_item for (img_item, f) in self._dwnlds.values() if f == f_complete]
-                if len(img_items) != 1:
-                    # we expect only one future is found in dictionary
+                url = self._future_to_url.get(f_complete)
+                if url is None:
+                    # we expect that each future is mapped to the image
                     raise RuntimeError("Wrong Implementation")
 
-                img_item = img_items[0]
+                img_item = self._items[url]
 
             if (done_callback is not None) and (not img_item.is_sent_to_obsrvr):
                 done_callback(self._get_download_info(img_item, f_complete))
@@ -369,11 +626,15 @@ class ImgDownloader:
 
         :param urls: URLs used to find download tasks to remove
         """
+        dwnlds = []
         for url in urls:
-            dwnld = self._dwnlds.pop(url, None)
-            if dwnld is not None:
-                (img_item, future) = dwnld
-                self._cancel(img_item, future)
+            img_item = self._items.pop(url, None)
+            if img_item is not None:
+                future = self._futures.pop(url)
+                self._future_to_url.pop(future, None)
+                dwnlds.append((img_item, future))
+
+        self._cancel(dwnlds)
 
     def cancel(self, *urls):
         """
@@ -381,10 +642,7 @@ class ImgDownloader:
 
         :param url: URLs used to find download tasks to cancel
         """
-        for url in urls:
-            if url in self._dwnlds:
-                (img_item, future) = self._dwnlds[url]
-                self._cancel(img_item, future)
+        self._cancel([(self._items[url], self._futures[url]) for url in urls if url in self._items])
 
     def restart(self, *urls):
         """
@@ -393,11 +651,49 @@ class ImgDownloader:
 
         :param urls: URLs used to find download tasks to restart.
         """
+        urls = [url for url in dict.fromkeys(urls) if url in self._items]
+        # cancel all download tasks first, so that they are stopped in parallel
+        self.cancel(*urls)
         for url in urls:
-            if url in self._dwnlds:
-                self.cancel(url)
-                (img_item, future) = self._dwnlds[url]
-                self._submit(img_item, True)
+            self._submit(self._items[url], True)
+
+    def resize_pool(self, threads_max):
+        """
+        Changes maximum number of threads which can run and execute download tasks in parallel.
+        Already added download tasks are finished by the previous threads, which are released afterwards.
+        New download tasks (also restarted ones) are executed by the new threads.
+
+        :param threads_max: new maximum number of threads which can run and execute download tasks in parallel.
+        """
+        if threads_max <= 0:
+            raise ValueError("threads_max has to be greater than 0")
+
+        with self._hosts_lock:
+            # download threads pass queued download tasks to the current thread pool under the same lock
+            tpool_prev = self._tpool
+            self._tpool = ThreadPoolExecutor(threads_max)
+        adapter_prev = self._adapter
+        self._adapter = self._mount_adapter(threads_max)
+        # let previous threads finish their download tasks without waiting for them, they are waited in close()
+        tpool_prev.shutdown(wait=False)
+        self._tpools_retired.append((tpool_prev, adapter_prev))
+
+    def close(self):
+        """
+        Waits until all download tasks are completed, then releases the threads, closes the HTTP session and all
+        connections kept alive by the download tasks. Should be called when the downloader is not needed anymore.
+        After that no new download tasks can be added.
+        """
+        # download tasks waiting for their host are passed to the pool by the finishing ones - wait for all of them
+        concurrent.futures.wait(list(self._futures.values()))
+        # threads of the previous thread pools can still be finishing their download tasks - wait for them as well
+        for (tpool, adapter) in self._tpools_retired:
+            tpool.shutdown()
+            # the pool is drained - connections of its adapter are not used anymore
+            adapter.close()
+        self._tpools_retired = []
+        self._tpool.shutdown()
+        self._session.close()
 
     def get_urls(self):
         """
@@ -405,7 +701,7 @@ class ImgDownloader:
 
         :return: all available URLs assigned to the download tasks.
         """
-        return [img_item.url for (img_item, f) in self._dwnlds.values()]
+        return list(self._items)
 
     def get_download_info(self, url):
         """
@@ -415,9 +711,8 @@ class ImgDownloader:
         :return: :class:`ImgDownloadInfo` object for the specified URL
         """
         dwnld_info = None
-        if url in self._dwnlds:
-            (img_item, future) = self._dwnlds[url]
-            dwnld_info = self._get_download_info(img_item, future)
+        if url in self._items:
+            dwnld_info = self._get_download_info(self._items[url], self._futures[url])
 
         return dwnld_info
 
@@ -429,9 +724,8 @@ class ImgDownloader:
         :return: :class:`ImgDownloadState` object of the download task based on the specified URL.
         """
         state = None
-        if url in self._dwnlds:
-            (img, future) = self._dwnlds[url]
-            state = self._get_download_state(img, future)
+        if url in self._items:
+            state = self._get_download_state(self._items[url], self._futures[url])
 
         return state
 
@@ -444,14 +738,13 @@ class ImgDownloader:
         specified download states.
         """
         for state in states:
-            if not ImgDownloadState.has_item(state):
+            if not isinstance(state, ImgDownloadState):
                 raise ValueError("state value should be a type of ImgDownloadState")
 
-        # find download tasks with the specified state
-        dwnlds = [(img_item, f) for (img_item, f) in self._dwnlds.values()
-                  if self._get_download_state(img_item, f) in states]
-
-        # acquire and return download infos for the found download tasks
-        dwnld_infos = [self._get_download_info(img_item, f) for (img_item,f) in dwnlds]
+        states = frozenset(states)
 
-        return dwnld_infos
+        # find download tasks with the specified state and acquire their download infos in one pass
+        return [ImgDownloadInfo(img_item.url, img_item.get_path(), state, img_item.exception)
+                for (url, img_item) in self._items.items()
+                for state in (self._get_download_state(img_item, self._futures[url]),)
+                if state in states]
@@ -1,9 +1,12 @@
-from urllib.parse import urlparse
+import re
+
+_URL_RE = re.compile(r'https?://\S+', re.IGNORECASE)
+""" URL is considered to be valid in case it has http or https scheme and doesn't contain spaces """
 
 
 def get_urls(file_path, logger_func=None):
     """
-    Reads the specified file and returns found URLs. Each line in the file has to contain only one URL.
+    Reads the specified file and returns found URLs. Each line in the file has to contain only one http or https URL.
     All spaces are ignored. In case of empty on invalid line logger_func will be called with the error text which also
     contains the information about invalid line number.
     In case file_path is invalid or file can't be open, exception will be raised. Please see :func:`.os.open` for
@@ -23,14 +26,13 @@ def get_urls(file_path, logger_func=None):
         return True
 
     with open(file_path) as f:
-        line_n = 0
-        for url in f:
+        # file is split only by new lines (unlike str.splitlines, which also splits by e.g. form feed)
+        for (line_n, url) in enumerate(f):
             # remove all spaces and new lines
             url = url.strip()
 
             # check if URL is valid
-            url_parsed = urlparse(url)
-            is_url_valid = bool(url_parsed.scheme)
+            is_url_valid = _URL_RE.fullmatch(url) is not None
             if not is_url_valid:
                 log("Line %u contains invalid URL" % line_n)
 
@@ -38,6 +40,4 @@ def get_urls(file_path, logger_func=None):
             if is_url_valid:
                 urls.append(url)
 
-            line_n += 1
-
     return urls
\ No newline at end of file
@@ -2,12 +2,15 @@ import unittest
 import shutil
 import os
 import time
+import tempfile
+import threading
 import responses
 from unittest.mock import patch
 
 from imgdownloader.imgdownloader import *
 
 url_wrong = "https://not.exist.com/wrong.png"
+url_unavailable = "https://not.available.com/unavailable.png"
 
 img_jpeg_correct = "y0nc6ianhueuc3tqnwkn5qbl0h4.jpeg"
 url_jpeg_correct = "https://habrastorage.org/webt/y0/nc/6i/" + img_jpeg_correct
@@ -24,111 +27,133 @@ sites_imgs_correct = [("https://habrastorage.org/webt/y0/nc/6i/", img_jpeg_corre
 
 urls_correct = [site+img_name for (site, img_name, extension) in sites_imgs_correct]
 
-dir_out = "./output/"
+
+def _read_img(img_name):
+    with open('tests/support/images/' + img_name, 'rb') as img_file:
+        return img_file.read()
+
+
+# content of the images is read only once and used by all tests in format ('url' : image data)
+_BODIES = {site + img_name: _read_img(img_name) for (site, img_name, extension) in sites_imgs_correct}
+
+# mocked responses are created only once and registered for each test
+_REGISTRATIONS = [responses.Response(method=responses.GET, url=site + img_name, body=_BODIES[site + img_name],
+                                     status=200, content_type='image/' + extension, stream=True)
+                  for (site, img_name, extension) in sites_imgs_correct] + \
+                 [responses.Response(method=responses.GET, url=url_wrong,
+                                     json={'error': 'not found'}, status=404),
+                  responses.Response(method=responses.GET, url=url_unavailable,
+                                     json={'error': 'service unavailable'}, status=503)]
 
 threads_max = 2
 
 
 def _delete_output(path):
-    # try to remove the output directory with all files inside
-    if os.path.exists(path):
-        # print("Deleting output directory")
-        shutil.rmtree(path, ignore_errors=True)
-        t = 0
-        # wait max 5 seconds until directory is deleted
-        while os.path.exists(path) and t < 5:  # check if it exists
-            t += 0.5
-            time.sleep(0.5)
+    # try to remove the output directory with all files inside, retry max 50 times in case it is still used
+    for _ in range(50):
+        try:
+            shutil.rmtree(path)
+            break
+        except FileNotFoundError:
+            # directory doesn't exist
+            break
+        except OSError:
+            time.sleep(0.05)
 
 
 class TestDownloads(unittest.TestCase):
     def _mock_responses(self):
-        for (site, img_name, extension) in sites_imgs_correct:
-            with open('tests/support/images/' + img_name, 'rb') as img_file:
-                responses.add(
-                    responses.GET, site + img_name,
-                    body=img_file.read(), status=200,
-                    content_type='image/' + extension,
-                    stream=True
-                )
-
-        responses.add(
-            responses.GET, url_wrong,
-            json={'error': 'not found'}, status=404
-        )
+        for response in _REGISTRATIONS:
+            self.rsps.add(response)
+
+    def _mock_responses_callback(self, before_response, *urls):
+        # replace mocked responses of the urls, so that before_response(request) is called before each response
+        # (e.g. to keep the download thread busy)
+        def request_callback(request):
+            before_response(request)
+            return 200, {}, _BODIES[request.url]
+
+        for url in urls:
+            self.rsps.remove(responses.GET, url)
+            self.rsps.add_callback(responses.GET, url, callback=request_callback)
+
+    def _wait_until(self, condition):
+        # check the condition every 0.05 seconds, max 5 seconds
+        for _ in range(100):
+            if condition():
+                break
+            time.sleep(0.05)
+        return condition()
 
     def _check_if_downloaded(self, dwnldr, dwnlds_expect, state_expect, *urls):
         # check the number of finished tasks
         self.assertEqual(dwnldr.imgs_total, dwnlds_expect)
         self.assertEqual(dwnldr.imgs_done, dwnlds_expect)
 
-        # check that image is really downloaded
+        if state_expect is not None:
+            # acquire download infos with expected state only once
+            dwnld_infos = {dwnld_info.url: dwnld_info
+                           for dwnld_info in dwnldr.get_download_infos_by_state(state_expect)}
+            self.assertEqual(len(dwnld_infos), len(urls))
+        else:
+            dwnld_infos = {url: dwnldr.get_download_info(url) for url in urls}
+
+        # check that image has expected state and is really downloaded
         for url in urls:
-            dwnld_info = dwnldr.get_download_info(url)
-            self.assertTrue(os.path.exists(dwnld_info.path))
+            self.assertIn(url, dwnld_infos)
+            self.assertTrue(os.path.exists(dwnld_infos[url].path))
 
-        if state_expect is not None:
-            self.assertEqual(len(dwnldr.get_download_infos_by_state(state_expect)), len(urls))
+    def setUp(self):
+        # each test has its own output directory, so that tests don't depend on each other
+        self.dir_out = tempfile.mkdtemp(prefix='imgdl-')
 
-    @classmethod
-    def setUpClass(cls):
-        # TODO _mock_responses() somehow doesn't work here, has to be investigated
-        pass
+        # mocks are registered once for each test and can be replaced by the test itself
+        self.rsps = responses.RequestsMock(assert_all_requests_are_fired=False)
+        self.rsps.start()
+        self._mock_responses()
 
-    @classmethod
-    def tearDownClass(cls):
-        responses.reset()
-        _delete_output(dir_out)
+    def tearDown(self):
+        self.rsps.stop()
+        self.rsps.reset()
+        _delete_output(self.dir_out)
 
-    @responses.activate
     def test_download_one(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         dwnldr.wait_until_downloaded()
 
         self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_correct)
 
-    @responses.activate
     def test_download_one_then_another(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
 
         # start downloading first task in the new thread, and after that next task, and so on.
         for url in urls_correct:
-            dwnldr.download(dir_out, False, url)
+            dwnldr.download(self.dir_out, False, url)
 
         dwnldr.wait_until_downloaded()
 
         self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
 
-    @responses.activate
     def test_download_tasks_more_than_threads(self):
-        self._mock_responses()
-
         # start downloading at the same N images. N should be more than maximum number of threads inside downloader.
         self.assertGreater(len(urls_correct), threads_max)
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, *urls_correct)
+        dwnldr.download(self.dir_out, False, *urls_correct)
         dwnldr.wait_until_downloaded()
 
         # check the number of finished tasks
         self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
 
-    @responses.activate
     @patch('time.sleep', return_value=None)
     def test_download_url_wrong(self, patched_time_sleep):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
 
-        dwnldr.download(dir_out, False, url_wrong)
+        dwnldr.download(self.dir_out, False, url_wrong)
         dwnldr.wait_until_downloaded()
 
-        # check the number ofr time.sleep calls
-        self.assertEqual(dwnldr.DOWNLOAD_FAIL_MAX, patched_time_sleep.call_count)
+        # image doesn't exist on the server - no retries are expected
+        self.assertEqual(0, patched_time_sleep.call_count)
 
         # check the number of finished tasks
         self.assertEqual(dwnldr.imgs_total, 1)
@@ -139,27 +164,94 @@ class TestDownloads(unittest.TestCase):
         dwnld_info = dwnldr.get_download_info(url_wrong)
         self.assertFalse(os.path.exists(dwnld_info.path))
 
-    @responses.activate
-    def test_download_downloading(self):
-        self._mock_responses()
+    def test_download_host_threads_max(self):
+        n_running = 0  # number of requests to the host processed at the same time
+        n_running_max = 0
+        lock = threading.Lock()
+
+        def count_running(request):
+            nonlocal n_running, n_running_max
+            with lock:
+                n_running += 1
+                n_running_max = max(n_running, n_running_max)
+            time.sleep(0.05)
+            with lock:
+                n_running -= 1
+
+        self._mock_responses_callback(count_running, *urls_correct)
+
+        # all images are located on the same host - they should be downloaded one by one
+        dwnldr = ImgDownloader(threads_max=threads_max, host_threads_max=1)
+        dwnldr.download(self.dir_out, True, *urls_correct)
+        dwnldr.wait_until_downloaded()
+
+        self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
+        self.assertEqual(n_running_max, 1)
+
+        self.assertRaises(ValueError, ImgDownloader, threads_max, 0)
+
+    def test_download_host_queued(self):
+        # the same image is available on another host
+        url_png_other = "https://other.host.org/" + img_png_correct
+        self.rsps.add(responses.GET, url_png_other, body=_BODIES[url_png_correct], status=200,
+                      content_type='image/png', stream=True)
+
+        # block the host until the image from another host is downloaded
+        is_released = threading.Event()
+        urls_blocked = [url_jpeg_correct, url_jpg_correct]
+        self._mock_responses_callback(lambda request: is_released.wait(5), *urls_blocked)
+
+        dwnldr = ImgDownloader(threads_max=2, host_threads_max=1)
+        dwnldr.download(self.dir_out, False, *urls_blocked, url_png_other)
+
+        """ second image of the blocked host waits for the host. Expected: image from another host is downloaded
+        by the second thread meanwhile """
+        self.assertTrue(self._wait_until(
+            lambda: dwnldr.get_download_state(url_png_other) == ImgDownloadState.FINISHED))
+        self.assertEqual(dwnldr.get_download_state(url_jpg_correct), ImgDownloadState.PENDING)
+
+        is_released.set()
+        dwnldr.wait_until_downloaded()
+        self._check_if_downloaded(dwnldr, 3, ImgDownloadState.FINISHED, *urls_blocked, url_png_other)
+
+    @patch('time.sleep', return_value=None)
+    def test_download_url_unavailable(self, patched_time_sleep):
+        dwnldr = ImgDownloader(threads_max=threads_max)
+
+        dwnldr.download(self.dir_out, False, url_unavailable)
+        dwnldr.wait_until_downloaded()
+
+        # check the number of retries
+        self.assertEqual(dwnldr.DOWNLOAD_FAIL_MAX, patched_time_sleep.call_count)
+
+        # time between retries grows, but never exceeds the maximum
+        retry_times = [args[0] for (args, kwargs) in patched_time_sleep.call_args_list]
+        self.assertGreater(retry_times[1], retry_times[0])
+        self.assertLessEqual(max(retry_times), dwnldr.DOWNLOAD_FAIL_RETRY_T_MAX)
+
+        # all retries together don't wait longer than the worst case of the retry settings
+        retry_times_max = [min(dwnldr.DOWNLOAD_FAIL_RETRY_T * (2 ** n) + dwnldr.DOWNLOAD_FAIL_RETRY_JITTER,
+                               dwnldr.DOWNLOAD_FAIL_RETRY_T_MAX) for n in range(dwnldr.DOWNLOAD_FAIL_MAX)]
+        self.assertLessEqual(sum(retry_times), sum(retry_times_max))
+
+        self.assertEqual(dwnldr.imgs_total, 1)
+        self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED_ERROR)), 1)
 
+    def test_download_downloading(self):
         dwnldr = ImgDownloader(threads_max=threads_max)
 
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         # download again the same url - nothing should happen
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         dwnldr.wait_until_downloaded()
         # download again the same url - nothing should happen
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
 
         self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_correct)
 
-    @responses.activate
     def test_download_img_name_exist(self):
-        self._mock_responses()
-
         # create the file with the name of downloading image
-        img_path = dir_out + img_jpeg_correct
+        img_path = os.path.join(self.dir_out, img_jpeg_correct)
         with open(img_path, 'w') as img_f:
             img_f.write("SOME RANDOM DATA")
 
@@ -168,17 +260,91 @@ class TestDownloads(unittest.TestCase):
         """ download the image which already exists. Set flag do_rewrite to True. Expected: image is downloaded
         and rewrites the existing one """
 
-        dwnldr.download(dir_out, True, url_jpeg_correct)
+        dwnldr.download(self.dir_out, True, url_jpeg_correct)
         dwnldr.wait_until_downloaded()
 
         # check that image is really downloaded
         self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_correct)
 
-    @responses.activate
+    def test_download_img_names_same(self):
+        # the same image is available under another url
+        url_jpeg_copy = "https://habrastorage.org/copy/" + img_jpeg_correct
+        self.rsps.add(responses.GET, url_jpeg_copy, body=_BODIES[url_jpeg_correct], status=200,
+                      content_type='image/jpeg', stream=True)
+
+        dwnldr = ImgDownloader(threads_max=threads_max)
+
+        """ download two images with the same name at once. Expected: images are stored under different names """
+        dwnldr.download(self.dir_out, False, url_jpeg_correct, url_jpeg_copy)
+        dwnldr.wait_until_downloaded()
+
+        self._check_if_downloaded(dwnldr, 2, ImgDownloadState.FINISHED, url_jpeg_correct, url_jpeg_copy)
+        self.assertNotEqual(dwnldr.get_download_info(url_jpeg_correct).path,
+                            dwnldr.get_download_info(url_jpeg_copy).path)
+
+    def test_download_img_created_later(self):
+        dwnldr = ImgDownloader(threads_max=threads_max)
+
+        """ output directory is listed by the first download. Expected: image is downloaded """
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
+        dwnldr.wait_until_downloaded()
+
+        """ image with the same name is created after the listing. Expected: the created file is not overwritten """
+        img_path_user = os.path.join(self.dir_out, img_png_correct)
+        with open(img_path_user, 'w') as f:
+            f.write("SOME RANDOM DATA")
+
+        dwnldr.download(self.dir_out, False, url_png_correct)
+        dwnldr.wait_until_downloaded()
+
+        self._check_if_downloaded(dwnldr, 2, ImgDownloadState.FINISHED, url_jpeg_correct, url_png_correct)
+        self.assertNotEqual(dwnldr.get_download_info(url_png_correct).path, img_path_user)
+        with open(img_path_user, 'r') as f:
+            self.assertEqual(f.read(), "SOME RANDOM DATA")
+
+    def test_download_dir_removed(self):
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
+        dwnldr.wait_until_downloaded()
+
+        """ output directory is removed after the first download. Expected: it is created again by the next one """
+        _delete_output(self.dir_out)
+        dwnldr.download(self.dir_out, False, url_png_correct)
+        dwnldr.wait_until_downloaded()
+
+        self.assertEqual(dwnldr.get_download_state(url_png_correct), ImgDownloadState.FINISHED)
+        self.assertTrue(os.path.exists(dwnldr.get_download_info(url_png_correct).path))
+
+    def test_download_part_exist(self):
+        # create not completely downloaded file of another program with the name of the temporary file
+        img_path_part = os.path.join(self.dir_out, img_jpeg_correct + ImgDownloader.PART_EXTENSION)
+        with open(img_path_part, 'w') as f:
+            f.write("SOME RANDOM DATA")
+
+        """ download image with the same name. Expected: image is downloaded, existing file is not touched """
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
+        dwnldr.wait_until_downloaded()
+
+        self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_correct)
+        with open(img_path_part) as f:
+            self.assertEqual(f.read(), "SOME RANDOM DATA")
+        self.assertEqual(sorted(os.listdir(self.dir_out)), sorted([img_jpeg_correct, os.path.basename(img_path_part)]))
+
+    def test_download_url_with_query(self):
+        url_jpeg_query = url_jpeg_correct + "?size=large#top"
+
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, False, url_jpeg_query)
+        dwnldr.wait_until_downloaded()
+
+        # query and fragment are not a part of the image name
+        self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_query)
+        self.assertEqual(dwnldr.get_download_info(url_jpeg_query).path,
+                         os.path.join(self.dir_out, img_jpeg_correct))
+
     @patch('time.sleep', return_value=None)
     def test_wait_until_downloaded(self, patched_time_sleep):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
 
         n_callback_calls = 0  # local variable for number of
@@ -188,7 +354,7 @@ class TestDownloads(unittest.TestCase):
 
         urls_downloading = [url_wrong, url_jpeg_correct, url_png_correct]
 
-        dwnldr.download(dir_out, False, *urls_downloading)
+        dwnldr.download(self.dir_out, False, *urls_downloading)
         dwnldr.cancel(url_jpeg_correct)
         dwnldr.wait_until_downloaded(complete_callback)
         # make sure that callback function was called N times, where N is equal to the number of downloading images
@@ -198,49 +364,81 @@ class TestDownloads(unittest.TestCase):
         sent with the previous call of wait_until_downloaded """
         self.assertEqual(n_callback_calls, len(urls_downloading))
 
-    @responses.activate
     def test_cancel_one(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         dwnldr.cancel(url_jpeg_correct)
 
         # check the number of finished tasks
         self.assertEqual(dwnldr.imgs_total, 1)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED)), 1)
 
-    @responses.activate
     def test_canel_all(self):
-        self._mock_responses()
-
         # start downloading at the same N images. N should be more than maximum number of threads inside downloader.
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, *urls_correct)
+        dwnldr.download(self.dir_out, False, *urls_correct)
         dwnldr.cancel(*urls_correct)
 
         # check the number of finished tasks
         self.assertEqual(dwnldr.imgs_total, len(urls_correct))
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED)), len(urls_correct))
 
-    @responses.activate
-    def test_cancel_url_not_exist(self):
-        self._mock_responses()
+    def test_cancel_pending(self):
+        # keep the only thread busy until pending task is cancelled
+        is_released = threading.Event()
+        self._mock_responses_callback(lambda request: is_released.wait(5), url_jpeg_correct)
+
+        dwnldr = ImgDownloader(threads_max=1)
+        dwnldr.download(self.dir_out, True, url_jpeg_correct, url_png_correct)
+        # the second task is waiting for the free thread
+        self.assertEqual(dwnldr.get_download_state(url_png_correct), ImgDownloadState.PENDING)
+        dwnldr.cancel(url_png_correct)
+        is_released.set()
+        dwnldr.wait_until_downloaded()
+
+        self.assertEqual(dwnldr.get_download_state(url_jpeg_correct), ImgDownloadState.FINISHED)
+        self.assertEqual(dwnldr.get_download_state(url_png_correct), ImgDownloadState.CANCELLED)
 
+    def test_cancel_running_img_exist(self):
+        is_requested = threading.Event()
+
+        def wait_until_cancelled(request):
+            # the response is sent only after the download task is flagged as cancelled, so that the downloaded
+            # image can never replace the existing one
+            is_requested.set()
+            self._wait_until(lambda: dwnldr._items[url_jpeg_correct].is_user_cancelled)
+
+        self._mock_responses_callback(wait_until_cancelled, url_jpeg_correct)
+
+        # create the file with the name of downloading image
+        img_path = os.path.join(self.dir_out, img_jpeg_correct)
+        with open(img_path, 'w') as img_f:
+            img_f.write("SOME RANDOM DATA")
+
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, True, url_jpeg_correct)
+        self.assertTrue(is_requested.wait(5))
+
+        # cancel the running download task. Expected: existing image is not touched
+        dwnldr.cancel(url_jpeg_correct)
+
+        self.assertEqual(dwnldr.get_download_state(url_jpeg_correct), ImgDownloadState.CANCELLED)
+        with open(img_path) as img_f:
+            self.assertEqual(img_f.read(), "SOME RANDOM DATA")
+        self.assertFalse(os.path.exists(img_path + dwnldr.PART_EXTENSION))
+
+    def test_cancel_url_not_exist(self):
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_wrong)
+        dwnldr.download(self.dir_out, False, url_wrong)
         dwnldr.cancel(url_wrong)
 
         # check the number of finished tasks
         self.assertEqual(dwnldr.imgs_total, 1)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED)), 1)
 
-    @responses.activate
     def test_cancel_canceled(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         dwnldr.cancel(url_jpeg_correct)
 
         # check the number of finished tasks
@@ -252,12 +450,9 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(dwnldr.imgs_total, 1)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED)), 1)
 
-    @responses.activate
     def test_remove_one(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         # remove directly after download is started
         dwnldr.remove(url_jpeg_correct)
 
@@ -268,12 +463,9 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.PENDING)), 0)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.RUNNING)), 0)
 
-    @responses.activate
     def test_remove_all(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, *urls_correct)
+        dwnldr.download(self.dir_out, False, *urls_correct)
         # wait until downloading is finished
         dwnldr.wait_until_downloaded()
 
@@ -282,12 +474,9 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(dwnldr.imgs_total, 0)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.FINISHED)), 0)
 
-    @responses.activate
     def test_restart_all(self):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, *urls_correct)
+        dwnldr.download(self.dir_out, False, *urls_correct)
         # restart during tasks are running
         dwnldr.restart(*urls_correct)
         dwnldr.wait_until_downloaded()
@@ -300,16 +489,13 @@ class TestDownloads(unittest.TestCase):
 
         self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
 
-    @responses.activate
     @patch('time.sleep', return_value=None)
     def test_restart_url_not_exist(self, patched_time_sleep):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
-        dwnldr.download(dir_out, False, url_wrong)
+        dwnldr.download(self.dir_out, False, url_unavailable)
         # restart immidiately after download is started
         patched_time_sleep.call_count = 0
-        dwnldr.restart(url_wrong)
+        dwnldr.restart(url_unavailable)
         dwnldr.wait_until_downloaded()
 
         # check the number of finished tasks
@@ -317,7 +503,7 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED_ERROR)), 1)
 
         # restart again task with the wrong url
-        dwnldr.restart(url_wrong)
+        dwnldr.restart(url_unavailable)
         dwnldr.wait_until_downloaded()
 
         self.assertEqual(dwnldr.DOWNLOAD_FAIL_MAX * 2, patched_time_sleep.call_count)
@@ -325,12 +511,9 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(dwnldr.imgs_total, 1)
         self.assertEqual(len(dwnldr.get_download_infos_by_state(ImgDownloadState.CANCELLED_ERROR)), 1)
 
-    @responses.activate
     def test_restart_img_exist(self):
-        self._mock_responses()
-
         # create the file with the name of downloading image
-        img_path = dir_out + img_jpeg_correct
+        img_path = os.path.join(self.dir_out, img_jpeg_correct)
         with open(img_path, 'w') as img_f:
             img_f.write("SOME RANDOM DATA")
 
@@ -339,7 +522,7 @@ class TestDownloads(unittest.TestCase):
         """ download the image which already exists. Set flag do_rewrite to False. Expected: image is downloaded
         and saved under the second name """
 
-        dwnldr.download(dir_out, False, url_jpeg_correct)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
         dwnldr.wait_until_downloaded()
 
         # check that image is really downloaded
@@ -354,15 +537,97 @@ class TestDownloads(unittest.TestCase):
         self.assertEqual(dwnld_info.path, dwnld_info_restarted.path)
         pass
 
-    @responses.activate
+    def test_resize_pool(self):
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
+
+        # download tasks added before and after resizing should be finished
+        dwnldr.resize_pool(1)
+        dwnldr.download(self.dir_out, False, url_png_correct, url_jpg_correct)
+        dwnldr.wait_until_downloaded()
+
+        self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
+
+        with self.assertRaises(ValueError):
+            dwnldr.resize_pool(0)
+
+    def test_resize_pool_host_queued(self):
+        # many images on the same host, downloaded one by one
+        urls_host = ["https://one.host.org/img%u.png" % n for n in range(20)]
+        for url in urls_host:
+            self.rsps.add(responses.GET, url, body=_BODIES[url_png_correct], status=200,
+                          content_type='image/png', stream=True)
+
+        # slow down passing of the download tasks to the pool, so that the pool is replaced meanwhile
+        submit = ThreadPoolExecutor.submit
+
+        def submit_slow(tpool, *args, **kwargs):
+            time.sleep(0.005)
+            return submit(tpool, *args, **kwargs)
+
+        dwnldr = ImgDownloader(threads_max=threads_max, host_threads_max=1)
+        with patch.object(ThreadPoolExecutor, 'submit', submit_slow):
+            dwnldr.download(self.dir_out, False, *urls_host)
+
+            """ resize the pool while download tasks are waiting for their host. Expected: all of them are done """
+            for _ in range(20):
+                dwnldr.resize_pool(threads_max)
+                time.sleep(0.005)
+
+            waiting = threading.Thread(target=dwnldr.wait_until_downloaded, daemon=True)
+            waiting.start()
+            waiting.join(5)
+            self.assertFalse(waiting.is_alive())
+
+        self._check_if_downloaded(dwnldr, len(urls_host), ImgDownloadState.FINISHED, *urls_host)
+        dwnldr.close()
+
+    def test_close(self):
+        dwnldr = ImgDownloader(threads_max=threads_max)
+        dwnldr.download(self.dir_out, False, *urls_correct)
+        dwnldr.wait_until_downloaded()
+        dwnldr.close()
+
+        # closing the downloader should not affect already finished download tasks
+        self._check_if_downloaded(dwnldr, len(urls_correct), ImgDownloadState.FINISHED, *urls_correct)
+
+        # downloader can't be used anymore
+        with self.assertRaises(RuntimeError):
+            dwnldr.restart(url_jpeg_correct)
+
+    def test_close_after_resize_pool(self):
+        is_released = threading.Event()
+        self._mock_responses_callback(lambda request: is_released.wait(5), url_jpeg_correct)
+
+        dwnldr = ImgDownloader(threads_max=1)
+        dwnldr.download(self.dir_out, False, url_jpeg_correct)
+        self.assertTrue(self._wait_until(
+            lambda: dwnldr.get_download_state(url_jpeg_correct) == ImgDownloadState.RUNNING))
+
+        """ resize the pool while the image is being downloaded by the previous pool and close the downloader.
+        Expected: close() waits for the previous pool and closes its adapter """
+        adapter_prev = dwnldr._session.get_adapter(url_jpeg_correct)
+        dwnldr.resize_pool(threads_max)
+
+        with patch.object(adapter_prev, 'close', wraps=adapter_prev.close) as patched_close:
+            closing = threading.Thread(target=dwnldr.close)
+            closing.start()
+            closing.join(0.1)
+            self.assertTrue(closing.is_alive())
+
+            is_released.set()
+            closing.join(5)
+            self.assertFalse(closing.is_alive())
+            patched_close.assert_called_once_with()
+
+        self._check_if_downloaded(dwnldr, 1, ImgDownloadState.FINISHED, url_jpeg_correct)
+
     @patch('time.sleep', return_value=None)
     def test_get_methods(self, patched_time_sleep):
-        self._mock_responses()
-
         dwnldr = ImgDownloader(threads_max=threads_max)
         urls_downloading = [url_wrong, url_jpeg_correct, url_png_correct]
 
-        dwnldr.download(dir_out, False, *urls_downloading)
+        dwnldr.download(self.dir_out, False, *urls_downloading)
         dwnldr.cancel(url_jpeg_correct)
         dwnldr.wait_until_downloaded()
 
@@ -2,6 +2,8 @@ import unittest
 import os
 import shutil
 import time
+import tempfile
+import threading
 
 from imgdownloader.urlsextractor import *
 
@@ -18,18 +20,16 @@ lines_in_file = [urls_in_file[0] + '\n',
 n_invalid_lines = 3  # pleas make sure that this number is always synchronized with lines_in_file @TDOO can be better done
 
 def delete_file(file_path):
-    # try to remove the fileif exists
-    if os.path.exists(file_path):
-        # print("Deleting output directory")
-
-        t = 0
-        # wait max 5 seconds until directory is deleted
-        while os.path.exists(file_path) and t < 5:  # check if it exists
-            try:
-                os.remove(file_path)
-            except:
-                t += 0.5
-                time.sleep(0.5)
+    # try to remove the file if exists, retry max 50 times in case it is still used
+    for _ in range(50):
+        try:
+            os.remove(file_path)
+            break
+        except FileNotFoundError:
+            # file doesn't exist
+            break
+        except OSError:
+            time.sleep(0.05)
 
 
 class UrlsExtractorTest(unittest.TestCase):
@@ -44,6 +44,20 @@ class UrlsExtractorTest(unittest.TestCase):
     def tearDownClass(cls):
         delete_file(file_path_urls)
 
+    def setUp(self):
+        # files created by the test are stored in its own temporary directory
+        self.dir_tmp = tempfile.mkdtemp(prefix='urlsextractor-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_tmp, ignore_errors=True)
+
+    def _write_file(self, content):
+        # write the content into the file as it is (new lines are not translated) and return its path
+        file_path = os.path.join(self.dir_tmp, 'urls.txt')
+        with open(file_path, 'w', newline='') as f:
+            f.write(content)
+        return file_path
+
 
     def test_get_urls(self):
         err_cnt = 0
@@ -62,6 +76,43 @@ class UrlsExtractorTest(unittest.TestCase):
         self.assertEqual(err_cnt, n_invalid_lines)
         # make sure that spaces and new line symbols are removed
 
+    def test_get_urls_file_empty(self):
+        self.assertEqual(get_urls(self._write_file('')), [])
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), "named pipes are not supported")
+    def test_get_urls_file_pipe(self):
+        # size of the pipe is always reported as 0, but URLs are still read from it
+        file_path_pipe = os.path.join(self.dir_tmp, 'urls.pipe')
+        os.mkfifo(file_path_pipe)
+
+        def write_urls():
+            with open(file_path_pipe, 'w') as f:
+                f.write(urls_in_file[0] + '\n')
+
+        writer = threading.Thread(target=write_urls)
+        writer.start()
+        try:
+            self.assertEqual(get_urls(file_path_pipe), [urls_in_file[0]])
+        finally:
+            writer.join()
+
+    def test_get_urls_scheme_not_supported(self):
+        file_path_schemes = self._write_file("ftp://habrastorage.org/img.png\n"
+                                             "habrastorage.org/img.png\n"
+                                             "https://habrastorage.org/img 2.png\n"
+                                             "HTTP://habrastorage.org/img.png\n")
+        self.assertEqual(get_urls(file_path_schemes), ["HTTP://habrastorage.org/img.png"])
+
+    def test_get_urls_line_numbers(self):
+        # form feed and vertical tab are not new lines - the second line is invalid
+        file_path_lines = self._write_file(urls_in_file[0] + '\r\n' + 'img\f.png\vimg.png\n' + urls_in_file[1] + '\r')
+
+        lines_invalid = []
+        urls_extracted = get_urls(file_path_lines, logger_func=lines_invalid.append)
+
+        self.assertEqual(urls_extracted, urls_in_file[:2])
+        self.assertEqual(lines_invalid, ["Line 1 contains invalid URL"])
+
     def test_get_urls_file_cantbe_open(self):
         with self.assertRaises(FileNotFoundError):
             get_urls(file_path_urls + 'WRONG')
\ No newline at end of file